@@ -0,0 +1,233 @@
+import hashlib
+import mmap
+import os
+import struct
+import traceback
+from collections.abc import Mapping
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+
+# 檔案格式：header + tag/內容的 offset 表與 UTF-8 blob + 量化向量 + 每列 scale
+# + （可選）正規化後的 float32 向量，供 re-rank 使用
+# 整個檔案以唯讀 mmap 開啟，多個 process 透過 OS page cache 共用同一份記憶體
+MAGIC = b"RAGEMB01"
+FORMAT_VERSION = 2
+_HEADER = struct.Struct("<8sIIIII32s7Q")
+_ALIGN = 64
+_SCORE_CHUNK = 4096
+
+DTYPES = {"float16": (1, np.float16), "int8": (2, np.int8)}
+_DTYPE_BY_CODE = {code: (name, dt) for name, (code, dt) in DTYPES.items()}
+
+
+def source_hash(docs: Dict[str, str], model: str) -> bytes:
+    """計算文件內容與 embedding 模型的 hash，用來判斷 store 是否過期"""
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8") + b"\0")
+    for tag, content in docs.items():
+        h.update(tag.encode("utf-8") + b"\0" + content.encode("utf-8") + b"\0")
+    return h.digest()
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _pack_strings(strings: List[str]) -> Tuple[bytes, bytes]:
+    blobs = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(b) for b in blobs])
+    return offsets.tobytes(), b"".join(blobs)
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """把每列向量正規化成單位長度（零向量維持不變）"""
+    emb = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(emb, axis=-1, keepdims=True)
+    return emb / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """把向量正規化後量化，回傳 (量化矩陣, 每列 scale)"""
+    if dtype not in DTYPES:
+        raise ValueError(f"不支援的 dtype：{dtype}，可用：{list(DTYPES)}")
+    emb = normalize(embeddings)
+    if dtype == "float16":
+        return emb.astype(np.float16), np.ones(len(emb), dtype=np.float32)
+    # int8：每列對稱量化，scale = max|x| / 127
+    scales = np.abs(emb).max(axis=1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    q = np.clip(np.rint(emb / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales
+
+
+def build_store(path: str, docs: Dict[str, str],
+                encode: Callable[[List[str]], np.ndarray], model: str,
+                dtype: str = "float16", with_f32: bool = False) -> None:
+    """編碼文件內容並寫成單一 store 檔（先寫暫存檔再 rename，避免其他 process 讀到一半的檔案）"""
+    if not docs:
+        raise ValueError("文件內容為空，無法建立 embedding store")
+    tags = list(docs.keys())
+    contents = [docs[tag] for tag in tags]
+    embeddings = np.atleast_2d(np.asarray(encode(contents), dtype=np.float32))
+    if embeddings.ndim != 2 or len(embeddings) != len(tags):
+        raise ValueError(
+            f"encoder 回傳的向量形狀 {embeddings.shape} 與文件數 {len(tags)} 不符")
+    matrix, scales = quantize(embeddings, dtype)
+    n, dim = matrix.shape
+
+    tag_idx, tag_blob = _pack_strings(tags)
+    text_idx, text_blob = _pack_strings(contents)
+    tag_idx_off = _HEADER.size
+    tag_blob_off = tag_idx_off + len(tag_idx)
+    text_idx_off = tag_blob_off + len(tag_blob)
+    text_blob_off = text_idx_off + len(text_idx)
+    vec_off = _align(text_blob_off + len(text_blob))
+    scale_off = _align(vec_off + matrix.nbytes)
+    f32_off = _align(scale_off + scales.nbytes) if with_f32 else 0
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, DTYPES[dtype][0], n, dim,
+                          int(with_f32), source_hash(docs, model), tag_idx_off,
+                          tag_blob_off, text_idx_off, text_blob_off, vec_off,
+                          scale_off, f32_off)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(tag_idx)
+        f.write(tag_blob)
+        f.write(text_idx)
+        f.write(text_blob)
+        f.write(b"\0" * (vec_off - f.tell()))
+        f.write(matrix.tobytes())
+        f.write(b"\0" * (scale_off - f.tell()))
+        f.write(scales.tobytes())
+        if with_f32:
+            f.write(b"\0" * (f32_off - f.tell()))
+            f.write(normalize(embeddings).tobytes())
+    os.replace(tmp_path, path)
+
+
+class EmbeddingStore(Mapping):
+    """以 mmap 開啟的 embedding store，行為和 tag -> 內容 的 dict 相同，文字在存取時才 decode"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except Exception as e:
+            # 檔案截斷或損毀時，先清掉 traceback 中指向 mmap 的 view，再關閉 mmap 往外拋
+            traceback.clear_frames(e.__traceback__)
+            self._release()
+            raise
+
+    def _load(self) -> None:
+        (magic, version, dtype_code, n, dim, has_f32, self.source_hash,
+         tag_idx_off, tag_blob_off, text_idx_off, text_blob_off, vec_off,
+         scale_off, f32_off) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or dtype_code not in _DTYPE_BY_CODE:
+            raise ValueError(f"不是有效的 embedding store 檔案：{self.path}")
+        self.dtype, np_dtype = _DTYPE_BY_CODE[dtype_code]
+        self.dim = dim
+        buf = memoryview(self._mm)
+        self._tag_idx = np.frombuffer(buf, np.uint64, n + 1, tag_idx_off)
+        self._tag_blob_off = tag_blob_off
+        self._text_idx = np.frombuffer(buf, np.uint64, n + 1, text_idx_off)
+        self._text_blob_off = text_blob_off
+        self.matrix = np.frombuffer(buf, np_dtype, n * dim, vec_off).reshape(n, dim)
+        self.scales = np.frombuffer(buf, np.float32, n, scale_off)
+        self.vectors = None
+        if has_f32:
+            self.vectors = np.frombuffer(buf, np.float32, n * dim, f32_off).reshape(n, dim)
+        self._index = {self.tag(i): i for i in range(n)}
+
+    @property
+    def has_f32(self) -> bool:
+        return self.vectors is not None
+
+    def _string(self, idx: np.ndarray, base: int, i: int) -> str:
+        start, end = base + int(idx[i]), base + int(idx[i + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def tag(self, i: int) -> str:
+        return self._string(self._tag_idx, self._tag_blob_off, i)
+
+    def content(self, i: int) -> str:
+        return self._string(self._text_idx, self._text_blob_off, i)
+
+    def __getitem__(self, tag: str) -> str:
+        return self.content(self._index[tag])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def scores(self, query_emb: np.ndarray) -> np.ndarray:
+        """直接在量化矩陣上計算 cosine 相似度（分塊計算，避免整個矩陣轉成 float32）"""
+        q = np.asarray(query_emb, dtype=np.float32).ravel()
+        norm = np.linalg.norm(q)
+        if norm:
+            q = q / norm
+        out = np.empty(len(self.matrix), dtype=np.float32)
+        for start in range(0, len(self.matrix), _SCORE_CHUNK):
+            chunk = self.matrix[start:start + _SCORE_CHUNK]
+            out[start:start + len(chunk)] = chunk.astype(np.float32) @ q
+        return out * self.scales
+
+    def search(self, query_emb: np.ndarray, k: int = 3) -> List[Tuple[int, float]]:
+        """回傳相似度最高的 k 筆 (index, score)"""
+        scores = self.scores(query_emb)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def rerank(self, query_emb: np.ndarray, candidates: List[Tuple[int, float]],
+               k: int = 3) -> List[Tuple[int, float]]:
+        """用 store 內的 float32 向量重新計算候選的 cosine 相似度，回傳前 k 筆 (index, score)"""
+        if self.vectors is None:
+            raise ValueError(f"embedding store 沒有 float32 向量，無法 re-rank：{self.path}")
+        if not candidates:
+            return []
+        idx = np.array([i for i, _ in candidates], dtype=np.int64)
+        scores = self.vectors[idx] @ normalize(np.ravel(query_emb))
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [(int(idx[i]), float(scores[i])) for i in order]
+
+    def _release(self) -> None:
+        # 先釋放指向 mmap 的 numpy view，才能關閉 mmap
+        self.matrix = self.scales = self.vectors = None
+        self._tag_idx = self._text_idx = None
+        self._mm.close()
+
+    def close(self) -> None:
+        self._release()
+
+
+def open_store(path: str, docs: Dict[str, str],
+               encode: Callable[[List[str]], np.ndarray], model: str, dim: int,
+               dtype: str = "float16", with_f32: bool = False) -> EmbeddingStore:
+    """開啟 store；檔案不存在、格式不符、文件或模型已更新時重新建立"""
+    expected = source_hash(docs, model)
+    if os.path.exists(path):
+        try:
+            store = EmbeddingStore(path)
+            if (store.source_hash == expected and store.dtype == dtype
+                    and store.dim == dim and (store.has_f32 or not with_f32)):
+                return store
+            store.close()
+        except (ValueError, struct.error):
+            pass
+    build_store(path, docs, encode, model, dtype, with_f32)
+    store = EmbeddingStore(path)
+    if store.dim != dim:
+        store.close()
+        raise ValueError(f"encoder 產生的向量維度 {store.dim} 與預期的 {dim} 不符")
+    return store
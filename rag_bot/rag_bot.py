@@ -8,6 +8,7 @@ import markdown
 import re
 import html
 import unicodedata
+from rag_bot.embedding_store import DTYPES, EmbeddingStore, open_store
 
 
 # Gemini API Key
@@ -20,7 +21,18 @@ llm = genai.GenerativeModel(version)
 print(f"rag_bot 模型初始化完成：{version}")
 
 # laod embedding 模型
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+embedder = SentenceTransformer(EMBEDDING_MODEL)
+
+# embedding store 設定：向量量化格式（float16 / int8）與 float32 re-rank 的候選數（0 表示不 re-rank）
+DOC_FILE = "KEYPO功能手冊文件.md"
+STORE_DTYPE = os.getenv("RAG_EMBEDDING_DTYPE", "float16")
+if STORE_DTYPE not in DTYPES:
+    raise ValueError(
+        f"RAG_EMBEDDING_DTYPE 不支援 {STORE_DTYPE}，可用：{list(DTYPES)}")
+RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "0"))
+_store = None
+_store_mtime = None
 
 
 # 定義狀態
@@ -75,6 +87,30 @@ def get_embedding(text: str) -> np.ndarray:
     return embedder.encode(text)
 
 
+# 取得 mmap 的 embedding store，不存在或文件更新時才重新編碼
+def get_store() -> EmbeddingStore:
+    global _store, _store_mtime
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    mtime = os.stat(os.path.join(base_path, DOC_FILE)).st_mtime_ns
+    if _store is None or mtime != _store_mtime:
+        docs = load_markdown_with_tags(DOC_FILE)
+        store_path = os.path.join(
+            base_path, f"{os.path.splitext(DOC_FILE)[0]}.{STORE_DTYPE}.emb")
+        _store = open_store(store_path, docs, embedder.encode, EMBEDDING_MODEL,
+                            embedder.get_sentence_embedding_dimension(),
+                            STORE_DTYPE, with_f32=RERANK_CANDIDATES > 0)
+        _store_mtime = mtime
+    return _store
+
+
+# 在量化矩陣上找出最相似的前 k 筆，可選擇用 store 內的 float32 向量重新排序候選
+def search_store(store: EmbeddingStore, question_emb: np.ndarray, k: int = 3) -> List[str]:
+    candidates = store.search(question_emb, max(k, RERANK_CANDIDATES))
+    if RERANK_CANDIDATES > 0:
+        candidates = store.rerank(question_emb, candidates, k)
+    return [store.tag(i) for i, _ in candidates[:k]]
+
+
 # 使用 LLM 檢查是否是列出 API 的問題
 def is_list_api_question(question: str) -> bool:
     prompt = f"""
@@ -119,7 +155,7 @@ def extract_api_from_question(question: str, api_list: List[str]) -> List[str]:
 # 檢索相關內容
 def retrieve(state: State) -> State:
     question = sanitize_input(state['question'])
-    docs = load_markdown_with_tags("KEYPO功能手冊文件.md")
+    docs = get_store()
     api_list = list(docs.keys())
 
     # 如果是要求列出所有 API，直接返回完整列表
@@ -145,37 +181,13 @@ def retrieve(state: State) -> State:
         state["retrieved_docs"] = retrieved_docs
         return state
 
-    # 否則進行 RAG 檢索
+    # 否則進行 RAG 檢索（直接在量化後的 embedding store 上計算相似度）
     question_emb = get_embedding(question)
-    similarities = {}
-    for tag, content in docs.items():
-        content_emb = get_embedding(content)
-        similarity = np.dot(question_emb, content_emb) / \
-            (np.linalg.norm(question_emb) * np.linalg.norm(content_emb))
-        similarities[tag] = similarity
-
-    # 選取相似度最高的前 3 個
-    top_docs = sorted(similarities.items(),
-                      key=lambda x: x[1], reverse=True)[:3]
-    retrieved = [f"API: {tag}\n內容: {docs[tag]}" for tag, _ in top_docs]
+    top_tags = search_store(docs, question_emb, 3)
+    retrieved = [f"API: {tag}\n內容: {docs[tag]}" for tag in top_tags]
 
     # 反向檢索：查詢內容後輸出 API 名稱
-    content_similarities = {}
-    for tag, content in docs.items():
-        content_emb = get_embedding(content)
-        content_similarity = np.dot(question_emb, content_emb) / \
-            (np.linalg.norm(question_emb) * np.linalg.norm(content_emb))
-        content_similarities[content] = content_similarity
-
-    # 選取內容相似度最高的前 3 個
-    top_contents = sorted(content_similarities.items(),
-                          key=lambda x: x[1], reverse=True)[:3]
-    retrieved_by_content = []
-    for content, _ in top_contents:
-        for tag, doc_content in docs.items():
-            if doc_content == content:
-                retrieved_by_content.append(f"內容: {content}\nAPI: {tag}")
-                break
+    retrieved_by_content = [f"內容: {docs[tag]}\nAPI: {tag}" for tag in top_tags]
 
     # 關鍵字檢索增強
     keyword_matches = []